@@ -1,6 +1,5 @@
 import cv2
 import numpy as np
-import json
 import argparse
 import logging
 import os
@@ -11,6 +10,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Number of rows formatted and written per chunk when streaming mesh arrays to JSON
+JSON_WRITE_BLOCK_ROWS = 4096
+
+def write_json_array(f, array, fmt, block_rows=JSON_WRITE_BLOCK_ROWS):
+    """
+    Streams a 2D NumPy array to an open text file as a compact JSON array of arrays.
+    Each block of rows is formatted with a single %-format of `fmt` (e.g. '%.5f' or '%d')
+    repeated per value, so the array is never converted to nested Python lists.
+    """
+    row_fmt = '[' + ','.join([fmt] * array.shape[1]) + ']'
+    f.write('[')
+    for start in range(0, len(array), block_rows):
+        block = array[start:start + block_rows]
+        if start > 0:
+            f.write(',')
+        f.write(','.join([row_fmt] * len(block)) % tuple(block.ravel().tolist()))
+    f.write(']')
+
 def generate_displaced_mesh(image_path, depth_path, output_json_path, grid_density=100, depth_scale=0.1):
     """
     Generates mesh data (vertices, UVs, faces) from an image and its depth map.
@@ -30,20 +47,19 @@ def generate_displaced_mesh(image_path, depth_path, output_json_path, grid_densi
 
     h, w = img.shape[:2]
     logger.info(f"Image dimensions: {w}x{h}")
-    # Ensure depth map has the same dimensions as the image, resize if necessary
-    if depth_map.shape[0] != h or depth_map.shape[1] != w:
-        logger.warning(f"Depth map dimensions ({depth_map.shape[1]}x{depth_map.shape[0]}) differ from image dimensions ({w}x{h}). Resizing depth map.")
-        depth_map = cv2.resize(depth_map, (w, h), interpolation=cv2.INTER_LINEAR)
+    # The depth map is sampled over the full image extent, so it does not need to be
+    # resized to the image dimensions first
+    depth_h, depth_w = depth_map.shape[:2]
+    if depth_h != h or depth_w != w:
+        logger.warning(f"Depth map dimensions ({depth_w}x{depth_h}) differ from image dimensions ({w}x{h}). Sampling it over the full image extent.")
 
     # Normalize depth map (0.0 = far, 1.0 = near - adjust if MiDaS output is inverse)
     # Assuming MiDaS output is higher value = closer, so normalize 0-1
     # Check for max depth value to avoid division by zero if depth map is all black
+    # Normalization is linear, so it is applied after sampling on the much smaller grid
     max_depth = np.max(depth_map)
     if max_depth == 0:
         logger.warning("Depth map is all black (max value is 0). Mesh will be flat.")
-        depth_normalized = np.zeros_like(depth_map, dtype=np.float32)
-    else:
-        depth_normalized = depth_map.astype(np.float32) / max_depth
     # If MiDaS outputs inverse depth (lower value = closer), use:
     # depth_normalized = 1.0 - (depth_map.astype(np.float32) / 255.0)
 
@@ -51,62 +67,86 @@ def generate_displaced_mesh(image_path, depth_path, output_json_path, grid_densi
     # Create a grid (normalized coordinates -1 to +1)
     # Adjust aspect ratio for the grid points
     aspect_ratio = w / h
+    # The grid is separable, so keep 1D per-column (x) and per-row (y) coordinates
+    # and broadcast them instead of materializing full 2D meshgrids
     x = np.linspace(-aspect_ratio, aspect_ratio, grid_density)
     y = np.linspace(-1, 1, grid_density)
-    xv, yv = np.meshgrid(x, y) # xv, yv are grid coordinates in world space
+    grid_h, grid_w = len(y), len(x)
 
-    # Sample depth map at grid points
-    # Map grid coords (-aspect_ratio to +aspect_ratio, -1 to 1) to image coords (0 to w-1, 0 to h-1)
-    img_x_coords = ((xv / aspect_ratio + 1) / 2 * w).astype(int)
-    img_y_coords = ((-yv + 1) / 2 * h).astype(int) # Flip Y-axis
-
-    # Clamp coordinates to be within image bounds
-    img_x_coords = np.clip(img_x_coords, 0, w - 1)
-    img_y_coords = np.clip(img_y_coords, 0, h - 1)
+    # Map grid coords to UV coords (0 to 1)
+    u = (x / aspect_ratio + 1) / 2
+    v = (-y + 1) / 2 # Flip Y-axis for UVs as well
 
-    # Sample depth at the calculated image coordinates
-    sampled_depth = depth_normalized[img_y_coords, img_x_coords]
+    # Sample depth map at grid points
+    if depth_w >= grid_w and depth_h >= grid_h:
+        # Fast path: the grid is coarser than the depth map, so area-average the depth
+        # map straight down to one value per vertex (rows follow v, i.e. flipped Y)
+        sampled_depth = cv2.resize(depth_map, (grid_w, grid_h), interpolation=cv2.INTER_AREA)
+        sampled_depth = sampled_depth[::-1].astype(np.float32)
+    else:
+        # Map grid coords (-aspect_ratio to +aspect_ratio, -1 to 1) to depth map coords (0 to w-1, 0 to h-1)
+        img_x_coords = (u * (depth_w - 1)).astype(np.float32)
+        img_y_coords = (v * (depth_h - 1)).astype(np.float32)
+        map_x = np.tile(img_x_coords, (grid_h, 1))
+        map_y = np.tile(img_y_coords[:, None], (1, grid_w))
+
+        # Bilinearly sample depth at the calculated image coordinates
+        # BORDER_REPLICATE clamps samples to be within image bounds
+        sampled_depth = cv2.remap(
+            depth_map.astype(np.float32), map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE
+        )
+    if max_depth > 0:
+        sampled_depth /= max_depth
 
     # Displace Z based on depth (adjust scale)
     # Center the displacement around z=0
     logger.info(f"Applying depth displacement with scale: {depth_scale}")
     zv = (sampled_depth - 0.5) * depth_scale
 
-    # Flatten vertices (X, Y, Z)
-    # Use the original grid coordinates (xv, yv) for X and Y
-    vertices = np.stack([xv.flatten(), yv.flatten(), zv.flatten()], axis=-1).tolist()
+    # Vertices (X, Y, Z) in row-major grid order, filled through a (rows, cols, 3) view
+    vertices = np.empty((grid_h * grid_w, 3), dtype=np.float32)
+    vertices_grid = vertices.reshape(grid_h, grid_w, 3)
+    vertices_grid[..., 0] = x[None, :]
+    vertices_grid[..., 1] = y[:, None]
+    vertices_grid[..., 2] = zv
 
     # Create UV coordinates (0 to 1)
-    # Map grid coords to UV coords (0 to 1)
-    u_coords = (xv / aspect_ratio + 1) / 2
-    v_coords = (-yv + 1) / 2 # Flip Y-axis for UVs as well
-    uvs = np.stack([u_coords.flatten(), v_coords.flatten()], axis=-1).tolist()
+    uvs = np.empty((grid_h * grid_w, 2), dtype=np.float32)
+    uvs_grid = uvs.reshape(grid_h, grid_w, 2)
+    uvs_grid[..., 0] = u[None, :]
+    uvs_grid[..., 1] = v[:, None]
 
     # Define faces (triangles for the grid)
-    faces = []
-    grid_h, grid_w = xv.shape
-    for i in range(grid_h - 1):
-        for j in range(grid_w - 1):
-            # Vertex indices in the flattened list
-            v0 = i * grid_w + j         # Top-left
-            v1 = i * grid_w + (j + 1)     # Top-right
-            v2 = (i + 1) * grid_w + j     # Bottom-left
-            v3 = (i + 1) * grid_w + (j + 1) # Bottom-right
-            # Triangle 1: v0, v1, v2 (Top-left, Top-right, Bottom-left)
-            faces.append([v0, v1, v2])
-            # Triangle 2: v1, v3, v2 (Top-right, Bottom-right, Bottom-left)
-            faces.append([v1, v3, v2])
-
-    mesh_data = {
-        "vertices": vertices,
-        "uvs": uvs,
-        "faces": faces
-    }
+    # Vertex indices of each grid cell's top-left corner in the flattened list
+    row_starts = np.arange(grid_h - 1, dtype=np.int32) * grid_w
+    v0 = row_starts[:, None] + np.arange(grid_w - 1, dtype=np.int32)[None, :]  # Top-left
+    v1 = v0 + 1                    # Top-right
+    v2 = v0 + grid_w               # Bottom-left
+    v3 = v2 + 1                    # Bottom-right
+    # Preallocate all faces as int32 and fill them through a (rows, cols, 2, 3) view,
+    # so each cell's two triangles stay adjacent without intermediate stacked arrays
+    faces = np.empty((2 * (grid_h - 1) * (grid_w - 1), 3), dtype=np.int32)
+    faces_grid = faces.reshape(grid_h - 1, grid_w - 1, 2, 3)
+    # Triangle 1: v0, v1, v2 (Top-left, Top-right, Bottom-left)
+    faces_grid[:, :, 0, 0] = v0
+    faces_grid[:, :, 0, 1] = v1
+    faces_grid[:, :, 0, 2] = v2
+    # Triangle 2: v1, v3, v2 (Top-right, Bottom-right, Bottom-left)
+    faces_grid[:, :, 1, 0] = v1
+    faces_grid[:, :, 1, 1] = v3
+    faces_grid[:, :, 1, 2] = v2
 
     logger.info(f"Writing mesh data to: {output_json_path}")
     try:
+        # Stream compact JSON straight from the arrays instead of json.dump on nested lists
         with open(output_json_path, 'w') as f:
-            json.dump(mesh_data, f, indent=4) # Use indent for readability
+            f.write('{"vertices":')
+            write_json_array(f, vertices, '%.5f')
+            f.write(',"uvs":')
+            write_json_array(f, uvs, '%.5f')
+            f.write(',"faces":')
+            write_json_array(f, faces, '%d')
+            f.write('}')
         logger.info(f"Successfully generated mesh data at: {output_json_path}")
     except IOError as e:
         logger.error(f"Error writing JSON file: {e}")
@@ -2,18 +2,148 @@
 import argparse
 import logging
 import os
+import queue
+import threading
 
 import cv2
 import numpy as np
 
+# Numba is optional (the "fast" extra: uv sync --extra fast): when installed,
+# views are warped with a fused JIT kernel
+try:
+    from numba import njit, prange
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 # Configure basic logging at the module level
 logging.basicConfig(
     level=logging.INFO, format="[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
 )
 logger = logging.getLogger(__name__)
 
+# Interpolation modes selectable with --interp
+INTERPOLATION_MODES = {
+    "linear": cv2.INTER_LINEAR,
+    "nearest": cv2.INTER_NEAREST,
+}
+
+# Encoder settings per output format selectable with --format. PNG uses a low zlib
+# level for fast encoding; JPEG is smaller still and SIFT does not need lossless input.
+IMAGE_WRITE_PARAMS = {
+    "png": [cv2.IMWRITE_PNG_COMPRESSION, 1],
+    "jpg": [cv2.IMWRITE_JPEG_QUALITY, 92],
+}
+
+# Per-thread map buffers reused across views warped by the same thread
+view_buffers = threading.local()
+
+# Maximum number of warped views waiting to be encoded, and the threads encoding them
+WRITE_QUEUE_SIZE = 4
+NUM_WRITER_THREADS = 2
+
+
+if NUMBA_AVAILABLE:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def warp_shifted_numba(img, basis, shift_amount, nearest, out):
+        """
+        Fused equivalent of building map_x_shifted and calling cv2.remap with
+        INTER_LINEAR (or INTER_NEAREST) and BORDER_REPLICATE. Rows never move
+        vertically, so the bilinear sample reduces to two horizontal taps per pixel.
+        """
+        h, w, channels = img.shape
+        for y in prange(h):
+            for x in range(w):
+                sx = x + shift_amount * basis[y, x]
+                if nearest:
+                    xn = min(max(int(np.floor(sx + 0.5)), 0), w - 1)
+                    for c in range(channels):
+                        out[y, x, c] = img[y, xn, c]
+                    continue
+                x0 = int(np.floor(sx))
+                fx = sx - x0
+                # Clamp both taps to the image (BORDER_REPLICATE)
+                x1 = min(max(x0 + 1, 0), w - 1)
+                x0 = min(max(x0, 0), w - 1)
+                for c in range(channels):
+                    value = img[y, x0, c] * (1.0 - fx) + img[y, x1, c] * fx
+                    out[y, x, c] = min(int(value + 0.5), 255)
+
+
+def save_view(warped, i, shift_amount, output_dir, image_format):
+    """Saves a warped view under its index and shift amount."""
+    output_filename = f"view_{i:03d}_shift_{shift_amount}.{image_format}"
+    output_filepath = os.path.join(output_dir, output_filename)
+    cv2.imwrite(output_filepath, warped, IMAGE_WRITE_PARAMS[image_format])
+    logger.debug(f"    Saved view to: {output_filepath}")
+
+
+def drain_view_writes(write_queue, errors):
+    """Saves queued (warped, i, shift_amount, output_dir, image_format) views until a None sentinel."""
+    while True:
+        item = write_queue.get()
+        if item is None:
+            return
+        try:
+            save_view(*item)
+        except Exception as e:
+            errors.append(e)
+
+
+def get_view_buffers(img):
+    """
+    Returns this thread's (map_x_shifted, map1, map2) buffers for `img`,
+    allocating them only on first use or when the image size changes.
+    """
+    if getattr(view_buffers, "shape", None) != img.shape:
+        h, w = img.shape[:2]
+        view_buffers.shape = img.shape
+        view_buffers.map_x_shifted = np.empty((h, w), dtype=np.float32)
+        view_buffers.map1 = np.empty((h, w, 2), dtype=np.int16)
+        view_buffers.map2 = np.empty((h, w), dtype=np.uint16)
+    return view_buffers.map_x_shifted, view_buffers.map1, view_buffers.map2
+
+
+def warp_shifted_view(
+    shift_amount, img, basis, map_x_base_f32, map_y, interpolation, warped
+):
+    """Warps the image by a single shift amount into `warped` with cv2.remap."""
+    # Calculate final horizontal shift incorporating depth and perspective
+    # Pixels further from the center (larger |relative_x|) will have their shift amplified
+    # The map buffers are reused from one view to the next; only `warped` is
+    # new per view, since it is handed to a writer thread
+    map_x_shifted, map1_buffer, map2_buffer = get_view_buffers(img)
+    np.multiply(basis, np.float32(shift_amount), out=map_x_shifted)
+    np.add(map_x_base_f32, map_x_shifted, out=map_x_shifted)
 
-def shift_view(image_path, depth_path, output_dir, shifts):
+    # Convert to OpenCV's fixed-point map format (CV_16SC2 + CV_16UC1), which
+    # halves the map bytes read by remap and uses its table-based interpolation
+    # Nearest-neighbour remap needs no interpolation table, only the integer map
+    map1, map2 = cv2.convertMaps(
+        map_x_shifted,
+        map_y,
+        cv2.CV_16SC2,
+        dstmap1=map1_buffer,
+        dstmap2=map2_buffer,
+        nninterpolation=interpolation == cv2.INTER_NEAREST,
+    )
+
+    # Remap the image using the shifted coordinates
+    cv2.remap(
+        img,
+        map1,
+        map2,
+        dst=warped,
+        interpolation=interpolation,
+        borderMode=cv2.BORDER_REPLICATE,
+    )
+
+
+def shift_view(
+    image_path, depth_path, output_dir, shifts, interp="linear", image_format="jpg"
+):
     """Generates shifted views of an image using its depth map."""
     logger.info(f"Reading image: {image_path}")
     img = cv2.imread(image_path)
@@ -46,41 +176,71 @@ def shift_view(image_path, depth_path, output_dir, shifts):
     # Adjust this value to control the 'convergence' effect. 0.0 = parallel shift.
     perspective_strength = 0.3
     logger.info(f"Using perspective strength: {perspective_strength}")
+    interpolation = INTERPOLATION_MODES[interp]
+    logger.info(f"Using {interp} interpolation")
+    if NUMBA_AVAILABLE:
+        logger.info("Numba found. Using fused JIT warp kernel.")
+
+    # Normalize depth to 0-1 range for shift calculation
+    depth_normalized = depth * np.float32(1.0 / 255.0)
+
+    # Calculate perspective scaling: 1.0 at center, >1.0 towards edges
+    # Avoid division by zero if width is very small (unlikely)
+    if center_x > 0:
+        perspective_scale = 1.0 + (np.abs(relative_x) / center_x) * perspective_strength
+    else:
+        perspective_scale = 1.0
+
+    # The per-pixel displacement for a unit shift does not depend on the shift amount,
+    # so compute it once; each view is then a single multiply-add over the base map
+    basis = (depth_normalized * perspective_scale).astype(np.float32)
+    map_x_base_f32 = map_x_base.astype(np.float32)
 
     logger.info(f"Generating {len(shifts)} shifted views...")
-    for i, shift_amount in enumerate(shifts):
-        logger.info(
-            f"  Generating view {i+1}/{len(shifts)} with shift {shift_amount}..."
-        )
-        # Normalize depth to 0-1 range for shift calculation
-        depth_normalized = depth / 255.0
-
-        # Calculate perspective scaling: 1.0 at center, >1.0 towards edges
-        # Avoid division by zero if width is very small (unlikely)
-        if center_x > 0:
-            perspective_scale = 1.0 + (np.abs(relative_x) / center_x) * perspective_strength
-        else:
-            perspective_scale = 1.0
-
-        # Calculate final horizontal shift incorporating depth and perspective
-        # Pixels further from the center (larger |relative_x|) will have their shift amplified
-        map_x_shifted = map_x_base.astype(np.float32) + \
-                        shift_amount * depth_normalized * perspective_scale
-
-        # Remap the image using the shifted coordinates
-        warped = cv2.remap(
-            img,
-            map_x_shifted,
-            map_y,
-            interpolation=cv2.INTER_LINEAR,
-            borderMode=cv2.BORDER_REPLICATE,
-        )
-
-        # Save the warped view
-        output_filename = f"view_{i:03d}_shift_{shift_amount}.png"
-        output_filepath = os.path.join(output_dir, output_filename)
-        cv2.imwrite(output_filepath, warped)
-        logger.debug(f"    Saved view to: {output_filepath}")
+    # Warp on this thread (the JIT kernel and cv2.remap are both multi-threaded) and
+    # hand finished views to writer threads, overlapping encoding with the next warp.
+    # The bounded queue caps how many views are held in memory if encoding falls behind.
+    write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    write_errors = []
+    writers = [
+        threading.Thread(target=drain_view_writes, args=(write_queue, write_errors))
+        for _ in range(NUM_WRITER_THREADS)
+    ]
+    for writer in writers:
+        writer.start()
+    try:
+        for i, shift_amount in enumerate(shifts):
+            logger.info(
+                f"  Generating view {i+1}/{len(shifts)} with shift {shift_amount}..."
+            )
+            warped = np.empty_like(img)
+            if NUMBA_AVAILABLE:
+                warp_shifted_numba(
+                    img,
+                    basis,
+                    np.float32(shift_amount),
+                    interpolation == cv2.INTER_NEAREST,
+                    warped,
+                )
+            else:
+                warp_shifted_view(
+                    shift_amount,
+                    img,
+                    basis,
+                    map_x_base_f32,
+                    map_y,
+                    interpolation,
+                    warped,
+                )
+            write_queue.put((warped, i, shift_amount, output_dir, image_format))
+    finally:
+        for _ in writers:
+            write_queue.put(None)
+        for writer in writers:
+            writer.join()
+    # Propagate any exception raised while saving a view
+    if write_errors:
+        raise write_errors[0]
 
     logger.info("View generation complete.")
 
@@ -107,7 +267,30 @@ if __name__ == "__main__":
         default=[-60, -30, 0, 30, 60],
         help="List of horizontal shift amounts.",
     )
+    parser.add_argument(
+        "--interp",
+        type=str,
+        choices=sorted(INTERPOLATION_MODES),
+        default="linear",
+        help="Interpolation used when warping views. 'nearest' is faster and is usually "
+        "sufficient for views fed to COLMAP. Defaults to 'linear'.",
+    )
+    parser.add_argument(
+        "--format",
+        dest="image_format",
+        type=str,
+        choices=sorted(IMAGE_WRITE_PARAMS),
+        default="jpg",
+        help="Image format of the generated views. Defaults to 'jpg'.",
+    )
 
     args = parser.parse_args()
 
-    shift_view(args.input_image, args.input_depth, args.output_dir, args.shifts)
+    shift_view(
+        args.input_image,
+        args.input_depth,
+        args.output_dir,
+        args.shifts,
+        args.interp,
+        args.image_format,
+    )
@@ -1,10 +1,10 @@
 # midas_depth.py
 import argparse
+import functools
 import logging
 import os
 
 import cv2
-import numpy as np
 import torch
 
 # Configure basic logging at the module level
@@ -13,17 +13,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# MODEL_TYPE = "MiDaS_small" # Smaller, faster model
+MODEL_TYPE = "DPT_Large"  # More accurate, larger model
 
-def run_depth_estimation(input_path, output_path):
-    """Runs MiDaS depth estimation on an input image and saves the depth map."""
+
+@functools.lru_cache(maxsize=None)
+def load_model(model_type=MODEL_TYPE):
+    """Loads a MiDaS model and its transform once per process and caches them."""
     logger.info("Loading MiDaS model...")
-    # model_type = "MiDaS_small" # Smaller, faster model
-    model_type = "DPT_Large"  # More accurate, larger model
     midas = torch.hub.load("intel-isl/MiDaS", model_type)
 
     # Check if CUDA is available and move the model to GPU if it is
     device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-    midas.to(device)
+    if device.type == "cuda":
+        # Run in FP16 with NHWC activations to use tensor-core kernels
+        midas = midas.to(device, memory_format=torch.channels_last).half()
+    else:
+        midas.to(device)
     midas.eval()
     logger.info(f"Using device: {device}")
 
@@ -34,36 +40,17 @@ def run_depth_estimation(input_path, output_path):
         if model_type == "DPT_Large"
         else midas_transforms.small_transform
     )
+    return midas, transform, device
 
-    logger.info(f"Reading input image: {input_path}")
-    img = cv2.imread(input_path)
-    if img is None:
-        logger.error(f"Error: Could not read image file {input_path}")
-        return
-
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-    logger.info("Transforming image...")
-    input_batch = transform(img_rgb).to(device)
 
-    logger.info("Running inference...")
-    with torch.no_grad():
-        prediction = midas(input_batch)
-
-        # Resize prediction to original image size
-        prediction = torch.nn.functional.interpolate(
-            prediction.unsqueeze(1),
-            size=img_rgb.shape[:2],
-            mode="bicubic",
-            align_corners=False,
-        ).squeeze()
-
-    depth_map = prediction.cpu().numpy()
-
-    logger.info("Normalizing and saving depth map...")
-    # Normalize depth map to 0-255 and convert to uint8
-    output = cv2.normalize(depth_map, None, 0, 255, cv2.NORM_MINMAX)
-    output = output.astype(np.uint8)
+def save_depth_map(prediction, output_path):
+    """Normalizes a single full-resolution prediction to 8-bit and saves it."""
+    # Normalize depth map to 0-255 and convert to uint8 on the prediction's device,
+    # so only one byte per pixel is copied back to the CPU
+    depth_min = prediction.min()
+    depth_range = prediction.max() - depth_min
+    normalized = (prediction - depth_min) / (depth_range + 1e-12)
+    output = (normalized * 255.0).clamp_(0, 255).to(torch.uint8).cpu().numpy()
 
     # Optional: Apply colormap for visualization
     # output_colored = cv2.applyColorMap(output, cv2.COLORMAP_INFERNO)
@@ -72,6 +59,73 @@ def run_depth_estimation(input_path, output_path):
     logger.info(f"Depth map saved to: {output_path}")
 
 
+def run_depth_estimation_batch(input_paths, output_paths, batch_size=4):
+    """
+    Runs MiDaS depth estimation on several images, reusing the cached model and
+    running inference on up to `batch_size` images at a time.
+    """
+    midas, transform, device = load_model(MODEL_TYPE)
+
+    for start in range(0, len(input_paths), batch_size):
+        # The DPT transform keeps the aspect ratio, so only inputs that transform
+        # to the same shape can be stacked into one batch
+        groups = {}
+        for input_path, output_path in zip(
+            input_paths[start : start + batch_size],
+            output_paths[start : start + batch_size],
+        ):
+            logger.info(f"Reading input image: {input_path}")
+            img = cv2.imread(input_path)
+            if img is None:
+                logger.error(f"Error: Could not read image file {input_path}")
+                continue
+
+            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+            logger.info("Transforming image...")
+            input_tensor = transform(img_rgb)
+            groups.setdefault(tuple(input_tensor.shape), []).append(
+                (input_tensor, img_rgb.shape[:2], output_path)
+            )
+
+        for items in groups.values():
+            input_batch = torch.cat([input_tensor for input_tensor, _, _ in items])
+            use_fp16 = device.type == "cuda"
+            if use_fp16:
+                input_batch = input_batch.to(
+                    device, memory_format=torch.channels_last
+                ).half()
+            else:
+                input_batch = input_batch.to(device)
+
+            logger.info(f"Running inference on a batch of {len(items)} image(s)...")
+            with torch.no_grad():
+                with torch.autocast(
+                    device_type=device.type, dtype=torch.float16, enabled=use_fp16
+                ):
+                    prediction = midas(input_batch)
+                # Upcast before resizing and normalizing the full-resolution map
+                prediction = prediction.float()
+
+                for (_, size, output_path), image_prediction in zip(items, prediction):
+                    # Resize prediction to original image size. Bilinear is enough since
+                    # the result is quantized to 8 bits, which discards bicubic's extra precision
+                    image_prediction = torch.nn.functional.interpolate(
+                        image_prediction[None, None],
+                        size=size,
+                        mode="bilinear",
+                        align_corners=False,
+                    ).squeeze()
+
+                    logger.info("Normalizing and saving depth map...")
+                    save_depth_map(image_prediction, output_path)
+
+
+def run_depth_estimation(input_path, output_path):
+    """Runs MiDaS depth estimation on an input image and saves the depth map."""
+    run_depth_estimation_batch([input_path], [output_path], batch_size=1)
+
+
 if __name__ == "__main__":
     # Logging is configured at the top level now
     # logging.basicConfig(
@@ -79,23 +133,38 @@ if __name__ == "__main__":
     # )
 
     parser = argparse.ArgumentParser(
-        description="Estimate depth from a single image using MiDaS."
+        description="Estimate depth from one or more images using MiDaS."
+    )
+    parser.add_argument(
+        "input_images", type=str, nargs="+", help="Path(s) to the input image file(s)."
     )
-    parser.add_argument("input_image", type=str, help="Path to the input image file.")
     parser.add_argument(
         "-o",
         "--output_path",
         type=str,
         default=None,
-        help="Path to save the output depth map (e.g., depth.png). Defaults to <input_image_name>_depth.png.",
+        help="Path to save the output depth map (e.g., depth.png). Only valid with a single input image. Defaults to <input_image_name>_depth.png.",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=4,
+        help="Number of images to run through the model at once. Defaults to 4.",
     )
     args = parser.parse_args()
 
-    # Determine the output path if not provided
-    output_path = args.output_path
-    if output_path is None:
-        base_name = os.path.splitext(args.input_image)[0]
-        output_path = f"{base_name}_depth.png"
-        logger.info(f"Output path not specified, defaulting to: {output_path}")
+    if args.output_path is not None and len(args.input_images) > 1:
+        parser.error("--output_path can only be used with a single input image.")
+
+    # Determine the output paths if not provided
+    if args.output_path is not None:
+        output_paths = [args.output_path]
+    else:
+        output_paths = []
+        for input_image in args.input_images:
+            base_name = os.path.splitext(input_image)[0]
+            output_paths.append(f"{base_name}_depth.png")
+            logger.info(f"Output path not specified, defaulting to: {output_paths[-1]}")
 
-    run_depth_estimation(args.input_image, output_path)
+    run_depth_estimation_batch(args.input_images, output_paths, args.batch_size)
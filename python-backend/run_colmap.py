@@ -1,8 +1,21 @@
 import argparse
+import contextlib
+import glob
+import hashlib
 import logging
 import os
+import re
+import shlex
 import subprocess
 import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
 
 # Configure basic logging
 logging.basicConfig(
@@ -10,163 +23,917 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def run_command(command, cwd=None, use_xvfb=False):
-    """Runs a shell command, logs output, and checks for errors."""
-    # Prepend xvfb-run if requested
-    if use_xvfb:
-        final_command = ["xvfb-run", "-a"] + command
-    else:
-        final_command = command
+# Executables resolved once from PATH at import time and invoked by absolute path
+COLMAP_BIN = shutil.which("colmap")
+XVFB_BIN = shutil.which("Xvfb")
+
+# Screen configuration of the virtual display used for GPU runs
+XVFB_SCREEN = "1024x768x24"
+
+# Thread count passed to COLMAP stages. COLMAP's mapper stops scaling beyond ~64
+# threads and gets slower from lock contention, so cap it there
+NUM_THREADS = min(64, os.cpu_count() or 1)
+
+# Number of trailing log lines reported when a command fails
+LOG_TAIL_LINES = 20
+# Chunk size for reading command output, and the minimum interval in seconds
+# between batched log messages in verbose mode
+OUTPUT_CHUNK_SIZE = 65536
+LOG_FLUSH_INTERVAL = 1.0
+# Seconds a single COLMAP command may run before it is killed
+COMMAND_TIMEOUT = 24 * 60 * 60
+
+# Feature matchers selectable with --matcher. "auto" picks sequential matching for
+# numbered frame sequences and exhaustive matching otherwise
+MATCHERS = ("auto", "exhaustive", "sequential", "vocab_tree")
+# Fraction of image filenames that must form one numbered sequence for "auto" to
+# treat the images as ordered
+ORDERED_NAME_FRACTION = 0.95
+# Filename extensions counted as images when detecting ordered sequences and
+# estimating workspace sizes
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+
+# Last pipeline stage selectable with --stage: "sparse" stops after mapping
+STAGES = ("sparse", "dense")
+
+# Mapper bundle-adjustment presets selectable with --mapper_preset. "fast" runs global
+# bundle adjustment less often and with fewer iterations, which suits large scenes
+MAPPER_PRESETS = {
+    "default": [],
+    "fast": [
+        "--Mapper.ba_global_images_ratio", "1.32",
+        "--Mapper.ba_global_points_ratio", "1.32",
+        "--Mapper.ba_global_max_num_iterations", "10",
+        "--Mapper.ba_global_max_refinements", "2",
+        "--Mapper.ba_local_max_num_iterations", "6",
+    ],
+}
 
-    logger.info(f"Running command: {' '.join(final_command)}")
+# Serializes appends to timings.csv from concurrently reconstructed sparse models
+timings_lock = threading.Lock()
+
+# Image sets larger than this are split into NUM_FEATURE_SHARDS (or one per GPU, if
+# more) for concurrent feature extraction into separate databases, merged afterwards
+FEATURE_SHARD_MIN_IMAGES = 2000
+NUM_FEATURE_SHARDS = 4
+
+# Smallest max_image_size tried when retrying dense stereo after running out of GPU memory
+MIN_DENSE_IMAGE_SIZE = 500
+
+# RAM-backed filesystem used for the dense workspace with --tmpfs
+TMPFS_DIR = "/dev/shm"
+# Approximate dense workspace bytes per input pixel: the undistorted image plus
+# photometric and geometric depth (4B) and normal (12B) maps
+DENSE_BYTES_PER_PIXEL = 3 + 2 * 16
+# Estimated bytes reserved on TMPFS_DIR by each live dense workspace. Concurrently
+# reconstructed models check free space against these, since their workspaces
+# have not been filled yet
+tmpfs_reservations = {}
+tmpfs_lock = threading.Lock()
+# Approximate database bytes per extracted feature: a keypoint (6 floats) and a
+# descriptor (128 bytes), tripled to cover matches and, for sharded extraction,
+# the shard and intermediate merged databases that exist at the same time
+DB_BYTES_PER_FEATURE = 3 * (6 * 4 + 128)
+
+def tail_file(path, num_lines=LOG_TAIL_LINES, max_bytes=16384):
+    """Returns the last `num_lines` lines of a text file, reading at most `max_bytes`."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - max_bytes))
+        data = f.read()
+    return data.decode(errors="replace").splitlines()[-num_lines:]
+
+def cuda_available():
+    """Checks whether a CUDA device is usable, preferring torch's probe when installed."""
     try:
-        # Popen inherits the current environment by default
-        process = subprocess.Popen(
-            final_command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True,
-            cwd=cwd
-        )
-        # Log output line by line
-        if process.stdout:
-            for line in iter(process.stdout.readline, ""):
-                logger.info(f"COLMAP: {line.strip()}")
-        process.wait()
+        import torch
+        if torch.cuda.is_available():
+            return True
+    except ImportError:
+        pass
+    # torch is missing or a CPU-only build; fall back to the NVIDIA driver tools
+    return gpu_count() > 0
+
+def gpu_count():
+    """Returns the number of visible CUDA devices, preferring torch's probe when installed."""
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return torch.cuda.device_count()
+    except ImportError:
+        pass
+    if not shutil.which("nvidia-smi"):
+        return 0
+    result = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True)
+    if result.returncode != 0:
+        return 0
+    num_gpus = len(result.stdout.splitlines())
+    # nvidia-smi lists every physical GPU; COLMAP only sees those in CUDA_VISIBLE_DEVICES
+    visible_devices = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible_devices is not None:
+        num_visible = len([device for device in visible_devices.split(",") if device.strip()])
+        num_gpus = min(num_gpus, num_visible)
+    return num_gpus
+
+def stream_output(stream, log_file=None):
+    """
+    Copies a command's binary output stream in large chunks to `log_file` (if given)
+    and forwards it to the logger in batches, at most once per LOG_FLUSH_INTERVAL.
+    """
+    pending = b""
+    last_flush = time.monotonic()
+    for chunk in iter(lambda: stream.read1(OUTPUT_CHUNK_SIZE), b""):
+        if log_file is not None:
+            log_file.write(chunk)
+        pending += chunk
+        now = time.monotonic()
+        if now - last_flush >= LOG_FLUSH_INTERVAL:
+            # Only emit complete lines; keep any partial line for the next batch
+            complete, _, pending = pending.rpartition(b"\n")
+            if complete:
+                logger.info("COLMAP:\n" + complete.decode(errors="replace"))
+            last_flush = now
+    if pending.strip():
+        logger.info("COLMAP:\n" + pending.decode(errors="replace").rstrip())
+
+def run_command(command, cwd=None, log_path=None, verbose=False, failure_level=logging.ERROR):
+    """
+    Runs a shell command, logs output, and checks for errors.
+    Failures are logged at `failure_level`, which callers lower for attempts they may retry.
+    Unless `verbose` is set, the command's output goes straight to `log_path`
+    without passing through Python; the tail of the log is reported on failure.
+    In verbose mode the output is also copied to `log_path` when given, and logged
+    in batches rather than one message per line by a drainer thread, so the pipe
+    never backs up and the command can be killed after COMMAND_TIMEOUT.
+    """
+    # Quoted so logged commands can be copied back into a shell
+    cmd_str = shlex.join(command)
+
+    logger.info(f"Running command: {cmd_str}")
+    try:
+        if verbose or log_path is None:
+            # Popen inherits the current environment by default
+            # Block-buffered binary pipe, drained in large chunks
+            process = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=-1,
+                cwd=cwd
+            )
+            with open(log_path, "wb", buffering=1 << 20) if log_path else contextlib.nullcontext() as log_file:
+                drainer = threading.Thread(target=stream_output, args=(process.stdout, log_file), daemon=True)
+                drainer.start()
+                try:
+                    wait_for_process(process, cmd_str)
+                except subprocess.TimeoutExpired:
+                    # Child processes of the killed command may keep the pipe open
+                    drainer.join(timeout=LOG_FLUSH_INTERVAL)
+                    raise
+                # The pipe reaches EOF once the process has exited
+                drainer.join()
+        else:
+            logger.info(f"Writing command output to: {log_path}")
+            # The child writes to the log file's descriptor directly; nothing is copied
+            # through Python. run() kills the command if it exceeds the timeout
+            with open(log_path, "wb") as log_file:
+                process = subprocess.run(
+                    command,
+                    stdout=log_file,
+                    stderr=subprocess.STDOUT,
+                    cwd=cwd,
+                    timeout=COMMAND_TIMEOUT,
+                )
         if process.returncode != 0:
-            logger.error(f"Command failed with exit code {process.returncode}: {' '.join(final_command)}")
-            raise subprocess.CalledProcessError(process.returncode, final_command)
-        logger.info(f"Command finished successfully: {' '.join(final_command)}")
+            logger.log(failure_level, f"Command failed with exit code {process.returncode}: {cmd_str}")
+            if not verbose and log_path is not None:
+                logger.log(failure_level, f"Last lines of {log_path}:")
+                for line in tail_file(log_path):
+                    logger.log(failure_level, f"COLMAP: {line}")
+            raise subprocess.CalledProcessError(process.returncode, command)
+        logger.info(f"Command finished successfully: {cmd_str}")
     except FileNotFoundError:
-        # Specifically check if it was xvfb-run or colmap that wasn't found
-        cmd_not_found = final_command[0]
+        # Report which executable wasn't found
+        cmd_not_found = command[0]
         logger.error(f"Error: '{cmd_not_found}' command not found. Is it installed and in your PATH?")
         raise
     except Exception as e:
-        logger.error(f"An unexpected error occurred: {e}")
+        logger.log(failure_level, f"An unexpected error occurred: {e}")
         raise
 
-def run_colmap_pipeline(image_dir, output_dir):
-    """Executes the full COLMAP reconstruction pipeline."""
+@contextlib.contextmanager
+def stage_timer(stage, csv_path=None, run_started=""):
+    """
+    Times the block and, when it succeeds, logs the elapsed time and appends a
+    `run_started,stage,elapsed_s` row to `csv_path` (writing the header to a new file).
+    `run_started` identifies the pipeline run, so rows from separate runs can be told apart.
+    """
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    logger.info(f"Stage {stage} took {elapsed:.1f}s")
+    if csv_path is not None:
+        with timings_lock, open(csv_path, "a") as f:
+            if f.tell() == 0:
+                f.write("run_started,stage,elapsed_s\n")
+            f.write(f"{run_started},{stage},{elapsed:.3f}\n")
+
+@contextlib.contextmanager
+def virtual_display():
+    """
+    Runs a single Xvfb server for the duration of the block and points DISPLAY at it,
+    instead of each COLMAP command starting its own server through xvfb-run.
+    """
+    # Xvfb picks a free display number and writes it to the pipe once it is ready
+    read_fd, write_fd = os.pipe()
+    process = subprocess.Popen(
+        [XVFB_BIN, "-displayfd", str(write_fd), "-screen", "0", XVFB_SCREEN, "-nolisten", "tcp"],
+        pass_fds=(write_fd,),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    os.close(write_fd)
+    with os.fdopen(read_fd) as display_pipe:
+        display_number = display_pipe.readline().strip()
+    if not display_number:
+        process.wait()
+        raise RuntimeError(f"Xvfb failed to start (exit code {process.returncode})")
+    previous_display = os.environ.get("DISPLAY")
+    os.environ["DISPLAY"] = f":{display_number}"
+    logger.info(f"Started Xvfb on display :{display_number}")
+    try:
+        yield
+    finally:
+        process.terminate()
+        process.wait()
+        if previous_display is None:
+            os.environ.pop("DISPLAY", None)
+        else:
+            os.environ["DISPLAY"] = previous_display
+
+def wait_for_process(process, cmd_str, timeout=COMMAND_TIMEOUT):
+    """Waits for `process` to exit, killing it and raising TimeoutExpired after `timeout` seconds."""
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.error(f"Command timed out after {timeout} seconds, killing it: {cmd_str}")
+        process.kill()
+        process.wait()
+        raise
+
+def step_marker(directory, step):
+    """Returns the path of the file recording that `step` completed for the outputs in `directory`."""
+    return os.path.join(directory, f".{step}.done")
+
+@contextlib.contextmanager
+def marking_completion(marker_path):
+    """
+    Removes `marker_path` before the block and recreates it only once the block succeeds,
+    so a step that fails or is killed part way is never taken as done.
+    """
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(marker_path)
+    yield
+    open(marker_path, "w").close()
+
+def list_sparse_models(sparse_path):
+    """
+    Returns the names of the finished sparse models in `sparse_path`. The mapper writes
+    one numbered sub-model per connected component of the scene.
+    """
+    # scandir reuses each entry's cached type instead of a stat() per entry; numeric
+    # sorting keeps "0" ahead of "10"
+    with os.scandir(sparse_path) as entries:
+        return sorted(
+            (
+                entry.name for entry in entries
+                if entry.is_dir(follow_symlinks=False)
+                and os.path.exists(os.path.join(entry.path, "cameras.bin"))
+            ),
+            key=lambda name: (0, int(name), "") if name.isdigit() else (1, 0, name),
+        )
+
+def list_image_files(image_dir):
+    """Returns the sorted names of the files directly inside `image_dir`."""
+    with os.scandir(image_dir) as entries:
+        return sorted(entry.name for entry in entries if entry.is_file())
+
+def list_images(image_dir):
+    """Returns the sorted names of the IMAGE_EXTENSIONS files directly inside `image_dir`."""
+    return [name for name in list_image_files(image_dir) if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+def detect_matcher(image_dir):
+    """
+    Returns "sequential" when at least ORDERED_NAME_FRACTION of the images in `image_dir`
+    form one numbered sequence (e.g. frame_0001.jpg, frame_0002.jpg), and "exhaustive" otherwise.
+    Sequence names share the text before their first number and extension, and the
+    numbers are unique and increase in name order, which is the order COLMAP matches in.
+    Hash-like names and mixed-camera sets (DSC_0001, IMG_0001) do not qualify.
+    """
+    names = list_images(image_dir)
+    numbered = []
+    for name in names:
+        match = re.match(r"(\D*)(\d+)", name)
+        if match:
+            numbered.append((match.group(1), os.path.splitext(name)[1].lower(), int(match.group(2))))
+    if not numbered:
+        return "exhaustive"
+    (prefix, extension), count = Counter((p, e) for p, e, _ in numbered).most_common(1)[0]
+    numbers = [number for p, e, number in numbered if (p, e) == (prefix, extension)]
+    increasing = all(a < b for a, b in zip(numbers, numbers[1:]))
+    if increasing and count >= ORDERED_NAME_FRACTION * len(names):
+        return "sequential"
+    return "exhaustive"
+
+def estimate_dense_workspace_bytes(image_dir):
+    """Estimates the size of the dense workspace (undistorted images plus depth/normal maps)."""
+    image_names = list_images(image_dir)
+    if not image_names:
+        return 0
+    # Views share the same dimensions, so a single image is enough for the estimate
+    img = cv2.imread(os.path.join(image_dir, image_names[0]))
+    if img is None:
+        return 0
+    h, w = img.shape[:2]
+    return len(image_names) * w * h * DENSE_BYTES_PER_PIXEL
+
+def create_tmpfs_workspace(image_dir, dense_path):
+    """
+    Creates a dense workspace directory on the RAM-backed TMPFS_DIR and returns its path,
+    or returns None when TMPFS_DIR is missing or the estimated workspace does not fit
+    next to those already reserved. The directory is named after `dense_path`, so a
+    workspace kept by a failed run is found and resumed by the next one.
+    Release it with remove_tmpfs_workspace or release_tmpfs_reservation.
+    """
+    if not os.path.isdir(TMPFS_DIR):
+        logger.warning(f"{TMPFS_DIR} not found. Using the on-disk dense workspace.")
+        return None
+    path_hash = hashlib.sha1(os.path.abspath(dense_path).encode()).hexdigest()[:12]
+    workspace = os.path.join(TMPFS_DIR, f"colmap_dense_{path_hash}")
+    if os.path.isdir(workspace):
+        # Its contents already count against the free space, so nothing is reserved
+        logger.info(f"Resuming tmpfs dense workspace: {workspace}")
+        return workspace
+    estimated_bytes = estimate_dense_workspace_bytes(image_dir)
+    with tmpfs_lock:
+        free_bytes = shutil.disk_usage(TMPFS_DIR).free - sum(tmpfs_reservations.values())
+        if estimated_bytes >= free_bytes:
+            logger.warning(f"Dense workspace (~{estimated_bytes / 1e9:.1f} GB) does not fit in {TMPFS_DIR} ({max(free_bytes, 0) / 1e9:.1f} GB free). Using the on-disk dense workspace.")
+            return None
+        os.makedirs(workspace)
+        tmpfs_reservations[workspace] = estimated_bytes
+    logger.info(f"Using tmpfs dense workspace: {workspace}")
+    return workspace
+
+def release_tmpfs_reservation(workspace):
+    """Releases the space reserved for a workspace made by create_tmpfs_workspace."""
+    with tmpfs_lock:
+        tmpfs_reservations.pop(workspace, None)
+
+def remove_tmpfs_workspace(workspace):
+    """Deletes a workspace made by create_tmpfs_workspace and releases its reservation."""
+    logger.info(f"Removing tmpfs dense workspace: {workspace}")
+    shutil.rmtree(workspace, ignore_errors=True)
+    release_tmpfs_reservation(workspace)
+
+def set_journal_mode(db_path, mode):
+    """Sets the SQLite journal mode of the database at `db_path`."""
+    with contextlib.closing(sqlite3.connect(db_path)) as conn:
+        conn.execute(f"PRAGMA journal_mode={mode}")
+
+@contextlib.contextmanager
+def database_workspace(output_db_path, db_dir=None, estimated_bytes=0):
+    """
+    Yields the database path COLMAP should use for the sparse steps. With `db_dir`, the
+    database is kept in a temporary directory there and moved to `output_db_path` on
+    exit, unless `estimated_bytes` does not fit in it. An existing output database is
+    reused. Step markers (see step_marker) next to the database travel with it.
+    """
+    if db_dir is not None:
+        os.makedirs(db_dir, exist_ok=True)
+        free_bytes = shutil.disk_usage(db_dir).free
+        if estimated_bytes >= free_bytes:
+            logger.warning(f"Database (~{estimated_bytes / 1e9:.1f} GB) does not fit in {db_dir} ({free_bytes / 1e9:.1f} GB free). Keeping it in the output directory.")
+            db_dir = None
+    if db_dir is None:
+        db_workspace = None
+        db_path = output_db_path
+    else:
+        db_workspace = tempfile.mkdtemp(prefix=f"colmap_db_{os.getpid()}_", dir=db_dir)
+        db_path = os.path.join(db_workspace, "colmap.db")
+        if os.path.exists(output_db_path):
+            shutil.copy2(output_db_path, db_path)
+            for marker_path in glob.glob(step_marker(os.path.dirname(output_db_path), "*")):
+                shutil.copy2(marker_path, db_workspace)
+        logger.info(f"Using database workspace: {db_workspace}")
+    # WAL appends writes to a log instead of rewriting pages in place, which avoids an
+    # fsync storm from the many small inserts during extraction and matching.
+    # The journal mode is stored in the database file, so it applies to COLMAP too
+    set_journal_mode(db_path, "WAL")
+    try:
+        yield db_path
+    finally:
+        # Checkpoint the WAL back into a single self-contained database file
+        set_journal_mode(db_path, "DELETE")
+        if db_workspace is not None:
+            # Markers go last, so an interrupted move never leaves a marker next to
+            # a database that lacks the step's results
+            output_dir = os.path.dirname(output_db_path)
+            for marker_path in glob.glob(step_marker(output_dir, "*")):
+                os.remove(marker_path)
+            logger.info(f"Moving database to: {output_db_path}")
+            shutil.move(db_path, output_db_path)
+            for marker_path in glob.glob(step_marker(db_workspace, "*")):
+                shutil.move(marker_path, output_dir)
+            shutil.rmtree(db_workspace, ignore_errors=True)
+
+def replace_option(command, option, value):
+    """Returns a copy of `command` with the value following `option` replaced by `value`."""
+    command = list(command)
+    command[command.index(option) + 1] = value
+    return command
+
+def extract_features_sharded(cmd_feature, image_names, num_shards, log_dir, verbose=False, num_gpus=0):
+    """
+    Runs `cmd_feature` concurrently on `num_shards` subsets of `image_names`, each into
+    its own database, and merges the results into the command's --database_path.
+    """
+    image_dir_abs = cmd_feature[cmd_feature.index("--image_path") + 1]
+    db_path = cmd_feature[cmd_feature.index("--database_path") + 1]
+    shard_dir = tempfile.mkdtemp(prefix="colmap_shards_", dir=os.path.dirname(db_path))
+    try:
+        shard_commands = []
+        shard_db_paths = []
+        for shard in range(num_shards):
+            # Symlinks keep image names identical to those under image_dir_abs, which
+            # the mapper and undistorter look up
+            shard_image_dir = os.path.join(shard_dir, f"images_{shard}")
+            os.makedirs(shard_image_dir)
+            for name in image_names[shard::num_shards]:
+                os.symlink(os.path.join(image_dir_abs, name), os.path.join(shard_image_dir, name))
+            shard_db_path = os.path.join(shard_dir, f"shard_{shard}.db")
+            set_journal_mode(shard_db_path, "WAL")
+            command = replace_option(cmd_feature, "--database_path", shard_db_path)
+            command = replace_option(command, "--image_path", shard_image_dir)
+            command = replace_option(command, "--SiftExtraction.gpu_index", str(shard % max(num_gpus, 1)))
+            command = replace_option(command, "--SiftExtraction.num_threads", str(max(1, NUM_THREADS // num_shards)))
+            shard_commands.append(command)
+            shard_db_paths.append(shard_db_path)
+
+        with ThreadPoolExecutor(max_workers=num_shards) as executor:
+            futures = [
+                executor.submit(run_command, command, log_path=os.path.join(log_dir, f"feature_extractor_{shard}.log"), verbose=verbose)
+                for shard, command in enumerate(shard_commands)
+            ]
+            for future in futures:
+                future.result()
+
+        # database_merger combines two databases at a time; the last merge writes
+        # a fresh database at db_path in place of any earlier, partial one
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        merged_db_path = shard_db_paths[0]
+        for shard in range(1, num_shards):
+            next_db_path = db_path if shard == num_shards - 1 else os.path.join(shard_dir, f"merged_{shard}.db")
+            cmd_merge = [
+                COLMAP_BIN, "database_merger",
+                "--database_path1", merged_db_path,
+                "--database_path2", shard_db_paths[shard],
+                "--merged_database_path", next_db_path,
+            ]
+            run_command(cmd_merge, log_path=os.path.join(log_dir, f"database_merger_{shard}.log"), verbose=verbose)
+            merged_db_path = next_db_path
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    # Each shard registered its own camera. All views share one camera, so point every
+    # image at the first one as a single feature_extractor run would have
+    with contextlib.closing(sqlite3.connect(db_path)) as conn:
+        conn.execute("UPDATE images SET camera_id = (SELECT MIN(camera_id) FROM cameras)")
+        conn.execute("DELETE FROM cameras WHERE camera_id != (SELECT MIN(camera_id) FROM cameras)")
+        conn.commit()
+    set_journal_mode(db_path, "WAL")
+
+def run_dense_reconstruction(
+    image_dir_abs,
+    sparse_model_path,
+    dense_workspace,
+    fused_ply_path,
+    log_dir,
+    verbose=False,
+    gpu_index="-1",
+    stereo_lock=None,
+    dense_max_image_size=1600,
+    dense_window_radius=5,
+    dense_num_samples=15,
+    dense_cache_size=32,
+    force=False,
+    timings_path=None,
+    run_started="",
+    stage_suffix="",
+):
+    """
+    Runs undistortion, dense stereo and fusion (Steps 4-6) for one sparse model.
+    Step timings are appended to `timings_path` for the run started at `run_started`,
+    as stage names ending in `stage_suffix`.
+    When given, `stereo_lock` is held for Step 5 so that models sharing a GPU take
+    turns on it while their CPU-bound undistortion and fusion run concurrently.
+    Steps already completed in `dense_workspace` (see step_marker) are skipped unless `force` is set.
+    """
+    # --- Step 4: Image Undistortion ---
+    undistort_marker = step_marker(dense_workspace, "image_undistorter")
+    if not force and os.path.exists(undistort_marker):
+        logger.info("Step 4: Undistorted images already exist, skipping.")
+    else:
+        force = True # Later steps depend on this step's output
+        logger.info("Step 4: Undistorting images...")
+        cmd_undistort = [
+            COLMAP_BIN, "image_undistorter",
+            "--image_path", image_dir_abs,
+            "--input_path", sparse_model_path,
+            "--output_path", dense_workspace,
+            "--output_type", "COLMAP",
+        ]
+        with marking_completion(undistort_marker), stage_timer(f"image_undistorter{stage_suffix}", timings_path, run_started):
+            run_command(cmd_undistort, log_path=os.path.join(log_dir, "image_undistorter.log"), verbose=verbose)
+
+    with stereo_lock or contextlib.nullcontext():
+        # --- Step 5: Dense Stereo Matching ---
+        stereo_marker = step_marker(dense_workspace, "patch_match_stereo")
+        if not force and os.path.exists(stereo_marker):
+            logger.info("Step 5: Depth maps already exist, skipping.")
+        else:
+            force = True # Later steps depend on this step's output
+            logger.info("Step 5: Dense stereo matching...")
+            stereo_log_path = os.path.join(log_dir, "patch_match_stereo.log")
+            max_image_size = dense_max_image_size
+            # Timed as one stage, including any out-of-memory retries
+            with marking_completion(stereo_marker), stage_timer(f"patch_match_stereo{stage_suffix}", timings_path, run_started):
+                while True:
+                    cmd_stereo = [
+                        COLMAP_BIN, "patch_match_stereo",
+                        "--workspace_path", dense_workspace,
+                        "--workspace_format", "COLMAP",
+                        "--PatchMatchStereo.geom_consistency", "true",
+                        # Smaller images, windows and sample counts trade quality for VRAM and speed
+                        "--PatchMatchStereo.max_image_size", str(max_image_size),
+                        "--PatchMatchStereo.window_radius", str(dense_window_radius),
+                        "--PatchMatchStereo.num_samples", str(dense_num_samples),
+                        "--PatchMatchStereo.cache_size", str(dense_cache_size), # In GB
+                        "--PatchMatchStereo.gpu_index", gpu_index,
+                    ]
+                    can_retry = max_image_size // 2 >= MIN_DENSE_IMAGE_SIZE
+                    try:
+                        run_command(
+                            cmd_stereo,
+                            log_path=stereo_log_path,
+                            verbose=verbose,
+                            failure_level=logging.WARNING if can_retry else logging.ERROR,
+                        )
+                        break
+                    except subprocess.CalledProcessError:
+                        # Retry GPU out-of-memory failures at a smaller image size instead of
+                        # leaving the whole pipeline to be re-run by hand
+                        out_of_memory = any("out of memory" in line.lower() for line in tail_file(stereo_log_path))
+                        if not out_of_memory or not can_retry:
+                            raise
+                        max_image_size //= 2
+                        logger.warning(f"patch_match_stereo ran out of GPU memory. Retrying with max_image_size {max_image_size}.")
+                        # patch_match_stereo skips images whose maps exist, so drop the maps
+                        # finished at the larger size rather than mixing resolutions
+                        for maps_dir in ("depth_maps", "normal_maps", "consistency_graphs"):
+                            maps_path = os.path.join(dense_workspace, "stereo", maps_dir)
+                            shutil.rmtree(maps_path, ignore_errors=True)
+                            os.makedirs(maps_path)
+
+    # Fusion runs on the CPU, so the GPU is released for the next model's stereo
+    # --- Step 6: Stereo Fusion ---
+    # The marker sits next to the fused point cloud, outside any tmpfs workspace
+    fusion_marker = step_marker(os.path.dirname(fused_ply_path), "stereo_fusion")
+    if not force and os.path.exists(fusion_marker):
+        logger.info("Step 6: Fused point cloud already exists, skipping.")
+    else:
+        logger.info("Step 6: Fusing stereo results into 3D model...")
+        cmd_fuse = [
+            COLMAP_BIN, "stereo_fusion",
+            "--workspace_path", dense_workspace,
+            "--workspace_format", "COLMAP",
+            "--input_type", "geometric",
+            "--output_path", fused_ply_path, # Written directly to its final location
+            "--StereoFusion.num_threads", str(NUM_THREADS),
+        ]
+        with marking_completion(fusion_marker), stage_timer(f"stereo_fusion{stage_suffix}", timings_path, run_started):
+            run_command(cmd_fuse, log_path=os.path.join(log_dir, "stereo_fusion.log"), verbose=verbose)
+
+def reconstruct_sparse_model(
+    image_dir_abs,
+    sparse_model_path,
+    dense_path,
+    log_dir,
+    use_tmpfs=False,
+    force=False,
+    **dense_options,
+):
+    """
+    Runs the dense steps for one sparse model into `dense_path` and returns the path
+    of its fused point cloud. `dense_options` are passed to run_dense_reconstruction.
+    A model whose fusion already completed is skipped unless `force` is set.
+    """
+    fused_ply_path = os.path.join(dense_path, "fused.ply")
+    if not force and os.path.exists(step_marker(dense_path, "stereo_fusion")):
+        logger.info(f"Fused point cloud already exists, skipping dense reconstruction: {fused_ply_path}")
+        return fused_ply_path
+    # Dense stereo does heavy random-access IO on its workspace, so optionally keep
+    # it in RAM; the fused point cloud is still written to the output directory
+    dense_workspace = dense_path
+    if use_tmpfs:
+        dense_workspace = create_tmpfs_workspace(image_dir_abs, dense_path) or dense_path
+    try:
+        run_dense_reconstruction(
+            image_dir_abs,
+            sparse_model_path,
+            dense_workspace,
+            fused_ply_path,
+            log_dir,
+            force=force,
+            **dense_options,
+        )
+    except BaseException:
+        # Keep the depth maps and step markers so the next run resumes from them
+        if dense_workspace != dense_path:
+            release_tmpfs_reservation(dense_workspace)
+            logger.warning(f"Keeping tmpfs dense workspace for the next run: {dense_workspace}")
+        raise
+    if dense_workspace != dense_path:
+        remove_tmpfs_workspace(dense_workspace)
+    return fused_ply_path
+
+def run_colmap_pipeline(
+    image_dir,
+    output_dir,
+    verbose=False,
+    dense_max_image_size=1600,
+    dense_window_radius=5,
+    dense_num_samples=15,
+    dense_cache_size=32,
+    use_tmpfs=False,
+    matcher="auto",
+    overlap=5,
+    vocab_tree_path=None,
+    mapper_preset="default",
+    sift_max_image_size=2400,
+    sift_max_num_features=4096,
+    stage="dense",
+    db_dir=None,
+    force=False,
+):
+    """
+    Executes the full COLMAP reconstruction pipeline.
+    The dense_* arguments bound the memory footprint and runtime of patch_match_stereo.
+    With `use_tmpfs`, the dense workspace is kept on TMPFS_DIR when it fits.
+    `matcher` is one of MATCHERS ("auto" is resolved by detect_matcher); sequential matching pairs each image with its
+    `overlap` neighbours, and `vocab_tree_path` enables vocab tree matching or
+    loop detection for sequential matching.
+    `mapper_preset` selects bundle-adjustment settings from MAPPER_PRESETS.
+    The sift_* arguments bound the image size and number of features extracted per
+    image, which in turn bounds the descriptor data read during matching.
+    With `stage` set to "sparse", the pipeline stops after mapping (Step 3) and
+    skips the dense reconstruction entirely.
+    With `db_dir`, the database is kept there (see database_workspace) during
+    Steps 1-3 and moved to the output directory afterwards. Features for more than
+    FEATURE_SHARD_MIN_IMAGES images are extracted in shards (see extract_features_sharded).
+    Steps that completed in an earlier run (see step_marker) are skipped, so a failed
+    run can be resumed; once a step runs, all later steps run too. `force` reruns every step.
+    """
     logger.info("Starting COLMAP pipeline...")
     logger.info(f"Input Image Directory: {image_dir}")
     logger.info(f"Output Directory: {output_dir}")
 
+    # --- Check for COLMAP ---
+    if COLMAP_BIN is None:
+        logger.error("COLMAP command not found. Please install COLMAP and ensure it's in your system's PATH.")
+        raise RuntimeError("COLMAP command not found")
+
     # --- Set Environment for Headless Qt (Robustness) ---
     os.environ["QT_QPA_PLATFORM"] = "offscreen"
     logger.info("Set QT_QPA_PLATFORM=offscreen for headless execution.")
 
     # --- Check for Xvfb and Decide on GPU Usage ---
     use_gpu = False
-    if shutil.which("xvfb-run"):
-        logger.info("Found 'xvfb-run'. Will attempt to use GPU with COLMAP via virtual framebuffer.")
-        use_gpu = True
-    else:
-        logger.warning("'xvfb-run' not found. COLMAP will run in CPU-only mode.")
+    if XVFB_BIN is None:
+        logger.warning("'Xvfb' not found. COLMAP will run in CPU-only mode.")
         logger.warning("Install 'xvfb' for potential GPU acceleration in headless environments.")
+    elif not cuda_available():
+        logger.warning("No CUDA device detected. COLMAP will run in CPU-only mode.")
+    else:
+        logger.info("Found 'Xvfb' and a CUDA device. Will use GPU with COLMAP via virtual framebuffer.")
+        use_gpu = True
     
     # COLMAP expects boolean flags as strings 'true' or 'false'
     gpu_flag_str = str(use_gpu).lower()
+    num_gpus = gpu_count() if use_gpu else 0
 
-    # --- Define Paths ---
-    base_dir = os.path.abspath(output_dir)
-    image_dir_abs = os.path.abspath(image_dir)
-    db_path = os.path.join(base_dir, "colmap.db")
-    sparse_path = os.path.join(base_dir, "sparse")
-    dense_path = os.path.join(base_dir, "dense")
-    fused_ply_path = os.path.join(dense_path, "fused.ply")
+    # One virtual display shared by every GPU step
+    with virtual_display() if use_gpu else contextlib.nullcontext():
+        # --- Define Paths ---
+        base_dir = os.path.abspath(output_dir)
+        image_dir_abs = os.path.abspath(image_dir)
+        db_path = os.path.join(base_dir, "colmap.db")
+        sparse_path = os.path.join(base_dir, "sparse")
+        dense_path = os.path.join(base_dir, "dense")
+        log_dir = os.path.join(base_dir, "logs")
+        # Per-stage durations, appended across runs for comparing parameter changes
+        timings_path = os.path.join(base_dir, "timings.csv")
+        run_started = time.strftime("%Y-%m-%dT%H:%M:%S")
 
-    # --- Create Output Directories ---
-    logger.info(f"Creating output directories...")
-    os.makedirs(base_dir, exist_ok=True)
-    os.makedirs(sparse_path, exist_ok=True)
-    os.makedirs(dense_path, exist_ok=True)
+        # --- Create Output Directories ---
+        logger.info(f"Creating output directories...")
+        os.makedirs(base_dir, exist_ok=True)
+        os.makedirs(sparse_path, exist_ok=True)
+        os.makedirs(dense_path, exist_ok=True)
+        os.makedirs(log_dir, exist_ok=True)
 
-    # --- Check for COLMAP ---
-    if not shutil.which("colmap"):
-        logger.error("COLMAP command not found. Please install COLMAP and ensure it's in your system's PATH.")
-        return False
-
-    # --- Step 1: Feature Extraction ---
-    logger.info("Step 1: Extracting features...")
-    cmd_feature = [
-        "colmap", "feature_extractor",
-        "--database_path", db_path,
-        "--image_path", image_dir_abs,
-        "--ImageReader.single_camera", "1",
-        "--ImageReader.camera_model", "PINHOLE",
-        "--SiftExtraction.use_gpu", gpu_flag_str # Use GPU if available
-    ]
-    run_command(cmd_feature, use_xvfb=use_gpu)
-
-    # --- Step 2: Feature Matching ---
-    logger.info("Step 2: Matching features...")
-    cmd_match = [
-        "colmap", "exhaustive_matcher",
-        "--database_path", db_path,
-        "--SiftMatching.use_gpu", gpu_flag_str # Use GPU if available
-    ]
-    run_command(cmd_match, use_xvfb=use_gpu)
-
-    # --- Step 3: Sparse Reconstruction (Mapping) ---
-    logger.info("Step 3: Sparse reconstruction (mapping)...")
-    cmd_map = [
-        "colmap", "mapper",
-        "--database_path", db_path,
-        "--image_path", image_dir_abs,
-        "--output_path", sparse_path,
-        # Consider adding mapper options if needed, e.g., related to camera parameters
-        "--Mapper.init_min_num_inliers", "50" # Lower threshold to help initialization
-    ]
-    run_command(cmd_map, use_xvfb=use_gpu)
+        if matcher == "vocab_tree" and vocab_tree_path is None:
+            raise ValueError("The vocab_tree matcher requires a vocabulary tree path.")
 
-    # --- Step 4: Image Undistortion ---
-    logger.info("Step 4: Undistorting images...")
-    sparse_model_path = os.path.join(sparse_path, "0")
-    if not os.path.exists(sparse_model_path):
-         alt_sparse_model_paths = [d for d in os.listdir(sparse_path) if os.path.isdir(os.path.join(sparse_path, d))]
-         if not alt_sparse_model_paths:
-             logger.error(f"Error: No sparse model found in {sparse_path}. Mapping might have failed.")
-             raise FileNotFoundError(f"No sparse model found in {sparse_path}")
-         sparse_model_path = os.path.join(sparse_path, alt_sparse_model_paths[0])
-         logger.warning(f"Sparse model '0' not found, using first available: {sparse_model_path}")
-
-    cmd_undistort = [
-        "colmap", "image_undistorter",
-        "--image_path", image_dir_abs,
-        "--input_path", sparse_model_path,
-        "--output_path", dense_path,
-        "--output_type", "COLMAP",
-    ]
-    run_command(cmd_undistort, use_xvfb=use_gpu)
-
-    # --- Step 5: Dense Stereo Matching ---
-    logger.info("Step 5: Dense stereo matching...")
-    cmd_stereo = [
-        "colmap", "patch_match_stereo",
-        "--workspace_path", dense_path,
-        "--workspace_format", "COLMAP",
-        "--PatchMatchStereo.geom_consistency", "true",
-        # PatchMatchStereo might also benefit from GPU, check COLMAP docs for specific flags 
-        # (e.g., --PatchMatchStereo.gpu_index can specify a GPU)
-    ]
-    run_command(cmd_stereo, use_xvfb=use_gpu)
+        # The database sees many small writes during Steps 1-3, so optionally keep it on
+        # fast storage. When all three steps already completed, it is used in place
+        sparse_steps_done = not force and all(os.path.exists(marker) for marker in (
+            step_marker(base_dir, "feature_extractor"),
+            step_marker(base_dir, "matcher"),
+            step_marker(sparse_path, "mapper"),
+        ))
+        if sparse_steps_done:
+            db_context = contextlib.nullcontext(db_path)
+        else:
+            estimated_db_bytes = len(list_image_files(image_dir_abs)) * sift_max_num_features * DB_BYTES_PER_FEATURE
+            db_context = database_workspace(db_path, db_dir, estimated_db_bytes)
+        with db_context as workspace_db_path:
+            # Database step markers sit next to the database so they move with it
+            feature_marker = step_marker(os.path.dirname(workspace_db_path), "feature_extractor")
+            match_marker = step_marker(os.path.dirname(workspace_db_path), "matcher")
+            map_marker = step_marker(sparse_path, "mapper")
 
-    # --- Step 6: Stereo Fusion ---
-    logger.info("Step 6: Fusing stereo results into 3D model...")
-    cmd_fuse = [
-        "colmap", "stereo_fusion",
-        "--workspace_path", dense_path,
-        "--workspace_format", "COLMAP",
-        "--input_type", "geometric",
-        "--output_path", fused_ply_path,
-    ]
-    run_command(cmd_fuse, use_xvfb=use_gpu)
+            # --- Step 1: Feature Extraction ---
+            if not force and os.path.exists(feature_marker):
+                logger.info("Step 1: Features already extracted, skipping.")
+            else:
+                force = True # Later steps depend on this step's output
+                logger.info("Step 1: Extracting features...")
+                cmd_feature = [
+                    COLMAP_BIN, "feature_extractor",
+                    "--database_path", workspace_db_path,
+                    "--image_path", image_dir_abs,
+                    "--ImageReader.single_camera", "1",
+                    # All views share one camera; a single focal length means one fewer BA parameter
+                    "--ImageReader.camera_model", "SIMPLE_PINHOLE",
+                    "--SiftExtraction.use_gpu", gpu_flag_str, # Use GPU if available
+                    "--SiftExtraction.gpu_index", "0",
+                    "--SiftExtraction.max_image_size", str(sift_max_image_size), # Cap extraction cost for large views
+                    "--SiftExtraction.max_num_features", str(sift_max_num_features), # Fewer descriptors to match
+                    # Descriptors keep COLMAP's default L1-root (RootSIFT) normalization, which matches more reliably
+                    "--SiftExtraction.num_threads", str(NUM_THREADS),
+                ]
+                image_names = list_image_files(image_dir_abs)
+                if len(image_names) > FEATURE_SHARD_MIN_IMAGES:
+                    # Separate databases avoid serializing every shard's writes on one file
+                    num_shards = max(num_gpus, NUM_FEATURE_SHARDS)
+                    logger.info(f"Extracting features for {len(image_names)} images in {num_shards} shards")
+                    with marking_completion(feature_marker), stage_timer("feature_extractor", timings_path, run_started):
+                        extract_features_sharded(cmd_feature, image_names, num_shards, log_dir, verbose=verbose, num_gpus=num_gpus)
+                else:
+                    with marking_completion(feature_marker), stage_timer("feature_extractor", timings_path, run_started):
+                        run_command(cmd_feature, log_path=os.path.join(log_dir, "feature_extractor.log"), verbose=verbose)
+
+            # --- Step 2: Feature Matching ---
+            if not force and os.path.exists(match_marker):
+                logger.info("Step 2: Features already matched, skipping.")
+            else:
+                force = True # Later steps depend on this step's output
+                logger.info("Step 2: Matching features...")
+                # Exhaustive matching is O(N^2) in the number of images. Views from generate_views.py
+                # are horizontal shifts named in shift order, so numbered sequences only need
+                # neighbouring images matched; vocab tree matching suits large unordered sets
+                if matcher == "auto":
+                    matcher = detect_matcher(image_dir_abs)
+                    logger.info(f"Detected {'an ordered' if matcher == 'sequential' else 'an unordered'} image set")
+                logger.info(f"Using {matcher} matcher")
+                cmd_match = [
+                    COLMAP_BIN, f"{matcher}_matcher",
+                    "--database_path", workspace_db_path,
+                    "--SiftMatching.use_gpu", gpu_flag_str, # Use GPU if available
+                    "--SiftMatching.num_threads", str(NUM_THREADS),
+                ]
+                if matcher == "sequential":
+                    cmd_match += ["--SequentialMatching.overlap", str(overlap)]
+                    if vocab_tree_path is not None:
+                        cmd_match += [
+                            "--SequentialMatching.loop_detection", "1",
+                            "--SequentialMatching.vocab_tree_path", vocab_tree_path,
+                        ]
+                elif matcher == "vocab_tree":
+                    cmd_match += ["--VocabTreeMatching.vocab_tree_path", vocab_tree_path]
+                with marking_completion(match_marker), stage_timer(f"{matcher}_matcher", timings_path, run_started):
+                    run_command(cmd_match, log_path=os.path.join(log_dir, f"{matcher}_matcher.log"), verbose=verbose)
+
+            # --- Step 3: Sparse Reconstruction (Mapping) ---
+            if not force and os.path.exists(map_marker):
+                logger.info("Step 3: Sparse models already exist, skipping.")
+            else:
+                force = True # Later steps depend on this step's output
+                logger.info("Step 3: Sparse reconstruction (mapping)...")
+                # Drop models from an earlier run so they are not mixed with the new ones
+                for model_name in list_sparse_models(sparse_path):
+                    shutil.rmtree(os.path.join(sparse_path, model_name))
+                cmd_map = [
+                    COLMAP_BIN, "mapper",
+                    "--database_path", workspace_db_path,
+                    "--image_path", image_dir_abs,
+                    "--output_path", sparse_path,
+                    # Consider adding mapper options if needed, e.g., related to camera parameters
+                    "--Mapper.init_min_num_inliers", "50", # Lower threshold to help initialization
+                    "--Mapper.num_threads", str(NUM_THREADS), # Bundle adjustment is multi-threaded
+                ] + MAPPER_PRESETS[mapper_preset]
+                logger.info(f"Using '{mapper_preset}' mapper preset")
+                with marking_completion(map_marker), stage_timer("mapper", timings_path, run_started):
+                    run_command(cmd_map, log_path=os.path.join(log_dir, "mapper.log"), verbose=verbose)
 
-    logger.info(f"COLMAP pipeline finished successfully. Output PLY: {fused_ply_path}")
-    return True # Indicate success
+        # --- Find Sparse Models ---
+        sparse_model_names = list_sparse_models(sparse_path)
+        if not sparse_model_names:
+            logger.error(f"Error: No sparse model found in {sparse_path}. Mapping might have failed.")
+            raise FileNotFoundError(f"No sparse model found in {sparse_path}")
+
+        if stage == "sparse":
+            sparse_model_paths = [os.path.join(sparse_path, name) for name in sparse_model_names]
+            logger.info(f"COLMAP pipeline finished successfully (sparse stage). Sparse models: {', '.join(sparse_model_paths)}")
+            return True # Indicate success
+
+        # --- Steps 4-6: Dense Reconstruction per Sparse Model ---
+        # A single model keeps the flat dense/ and logs/ layout; multiple models are
+        # reconstructed concurrently, each into its own dense/<model>/ and logs/<model>/.
+        # Stereo holds one lock per GPU group (or a single lock on CPU), so CPU-bound undistortion
+        # of the next model and fusion of the previous one overlap with stereo of the current one.
+        num_models = len(sparse_model_names)
+        if num_gpus <= 1 or num_models == 1:
+            # -1 lets patch_match_stereo use every visible GPU
+            gpu_groups = ["-1"]
+        elif num_models < num_gpus:
+            # Fewer models than GPUs: each model gets its own share of the GPUs
+            gpu_groups = [",".join(map(str, range(num_gpus)[i::num_models])) for i in range(num_models)]
+        else:
+            gpu_groups = [str(i) for i in range(num_gpus)]
+        stereo_locks = [threading.Lock() for _ in gpu_groups]
+        dense_tasks = []
+        for task_index, model_name in enumerate(sparse_model_names):
+            model_dense_path = dense_path
+            model_log_dir = log_dir
+            stage_suffix = ""
+            if len(sparse_model_names) > 1:
+                model_dense_path = os.path.join(dense_path, model_name)
+                model_log_dir = os.path.join(log_dir, model_name)
+                stage_suffix = f"/{model_name}"
+                os.makedirs(model_dense_path, exist_ok=True)
+                os.makedirs(model_log_dir, exist_ok=True)
+            dense_tasks.append(dict(
+                sparse_model_path=os.path.join(sparse_path, model_name),
+                dense_path=model_dense_path,
+                log_dir=model_log_dir,
+                stage_suffix=stage_suffix,
+                # Spread models round-robin across the GPU groups
+                gpu_index=gpu_groups[task_index % len(gpu_groups)],
+                stereo_lock=stereo_locks[task_index % len(stereo_locks)],
+            ))
+
+        # COLMAP does the work in child processes, so threads are enough to overlap them.
+        # One worker per stereo slot, plus one undistorting the next model ahead of time
+        # and one fusing the previous model
+        max_workers = min(len(dense_tasks), len(stereo_locks) + 2)
+        if len(dense_tasks) > 1:
+            logger.info(f"Found {len(dense_tasks)} sparse models. Reconstructing up to {max_workers} concurrently.")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    reconstruct_sparse_model,
+                    image_dir_abs,
+                    use_tmpfs=use_tmpfs,
+                    verbose=verbose,
+                    dense_max_image_size=dense_max_image_size,
+                    dense_window_radius=dense_window_radius,
+                    dense_num_samples=dense_num_samples,
+                    dense_cache_size=dense_cache_size,
+                    force=force,
+                    timings_path=timings_path,
+                    run_started=run_started,
+                    **task,
+                )
+                for task in dense_tasks
+            ]
+            fused_ply_paths = [future.result() for future in futures]
+
+        logger.info(f"COLMAP pipeline finished successfully. Output PLY: {', '.join(fused_ply_paths)}")
+        return True # Indicate success
 
 
 if __name__ == "__main__":
@@ -183,6 +950,97 @@ if __name__ == "__main__":
         default="./colmap_output",
         help="Directory to store COLMAP intermediate and final results. Defaults to './colmap_output'."
     )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="Stream COLMAP output through the logger instead of writing it to per-step log files in <output_dir>/logs."
+    )
+    parser.add_argument(
+        "--dense_max_image_size",
+        type=int,
+        default=1600,
+        help="Maximum image size used by dense stereo. Lower values reduce GPU memory and runtime; it is halved automatically if dense stereo runs out of GPU memory. Defaults to 1600."
+    )
+    parser.add_argument(
+        "--dense_window_radius",
+        type=int,
+        default=5,
+        help="Patch window radius used by dense stereo. Defaults to 5."
+    )
+    parser.add_argument(
+        "--dense_num_samples",
+        type=int,
+        default=15,
+        help="Number of source image samples used by dense stereo. Defaults to 15."
+    )
+    parser.add_argument(
+        "--dense_cache_size",
+        type=int,
+        default=32,
+        help="Cache size in GB for dense stereo workspace data. Defaults to 32."
+    )
+    parser.add_argument(
+        "--matcher",
+        type=str,
+        choices=MATCHERS,
+        default="auto",
+        help="COLMAP feature matcher. 'sequential' suits ordered views, 'vocab_tree' large unordered sets. 'auto' uses 'sequential' for numbered filenames and 'exhaustive' otherwise. Defaults to 'auto'."
+    )
+    parser.add_argument(
+        "--overlap",
+        type=int,
+        default=5,
+        help="Number of neighbouring images matched by the sequential matcher. Defaults to 5."
+    )
+    parser.add_argument(
+        "--vocab_tree_path",
+        type=str,
+        default=None,
+        help="Vocabulary tree file. Required by the vocab_tree matcher; enables loop detection for the sequential matcher."
+    )
+    parser.add_argument(
+        "--mapper_preset",
+        type=str,
+        choices=sorted(MAPPER_PRESETS),
+        default="default",
+        help="Mapper bundle-adjustment preset. 'fast' runs global bundle adjustment less often, for large scenes. Defaults to 'default'."
+    )
+    parser.add_argument(
+        "--sift_max_image_size",
+        type=int,
+        default=2400,
+        help="Maximum image size used for SIFT feature extraction. Defaults to 2400."
+    )
+    parser.add_argument(
+        "--sift_max_num_features",
+        type=int,
+        default=4096,
+        help="Maximum number of SIFT features extracted per image. Defaults to 4096."
+    )
+    parser.add_argument(
+        "--stage",
+        type=str,
+        choices=STAGES,
+        default="dense",
+        help="Last pipeline stage to run. 'sparse' stops after mapping and skips dense stereo. Defaults to 'dense'."
+    )
+    parser.add_argument(
+        "--db_dir",
+        type=str,
+        default=None,
+        help="Fast storage directory (e.g. /dev/shm) holding the COLMAP database during feature extraction, matching and mapping, when it fits. By default the database stays in <output_dir>."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rerun every step. By default, steps whose outputs already exist in <output_dir> are skipped."
+    )
+    parser.add_argument(
+        "--tmpfs",
+        action="store_true",
+        help="Keep the dense stereo workspace in /dev/shm when it fits. Only the fused point cloud is kept in <output_dir>/dense. A failed run leaves its workspace in /dev/shm for the next --tmpfs run to resume; it does not survive a reboot."
+    )
 
     args = parser.parse_args()
 
@@ -192,7 +1050,25 @@ if __name__ == "__main__":
         exit(1)
 
     try:
-        run_colmap_pipeline(args.image_dir, args.output_dir)
+        run_colmap_pipeline(
+            args.image_dir,
+            args.output_dir,
+            verbose=args.verbose,
+            dense_max_image_size=args.dense_max_image_size,
+            dense_window_radius=args.dense_window_radius,
+            dense_num_samples=args.dense_num_samples,
+            dense_cache_size=args.dense_cache_size,
+            use_tmpfs=args.tmpfs,
+            matcher=args.matcher,
+            overlap=args.overlap,
+            vocab_tree_path=args.vocab_tree_path,
+            mapper_preset=args.mapper_preset,
+            sift_max_image_size=args.sift_max_image_size,
+            sift_max_num_features=args.sift_max_num_features,
+            stage=args.stage,
+            db_dir=args.db_dir,
+            force=args.force,
+        )
     except Exception as e:
         logger.error(f"COLMAP pipeline failed: {e}")
         exit(1) 
@@ -53,21 +53,21 @@ fi
 
 # --- Install Xvfb (Virtual Framebuffer for headless GPU) ---
 echo "Checking for Xvfb..."
-if ! command -v xvfb-run &> /dev/null
+if ! command -v Xvfb &> /dev/null
 then
-    echo "Xvfb (xvfb-run) not found. Attempting installation using apt (requires sudo)."
+    echo "Xvfb not found. Attempting installation using apt (requires sudo)."
     apt-get update && apt-get install -y xvfb
     echo "Verifying Xvfb installation after apt install..."
-    if ! command -v xvfb-run &> /dev/null
+    if ! command -v Xvfb &> /dev/null
     then
         echo "Xvfb installation via apt failed or command still not found."
         echo "GPU acceleration for COLMAP in headless mode might not work."
         # Don't exit, as the rest might still work without GPU COLMAP
     else
-        echo "Xvfb (xvfb-run) successfully installed via apt."
+        echo "Xvfb successfully installed via apt."
     fi
 else
-    echo "Xvfb found: $(command -v xvfb-run)"
+    echo "Xvfb found: $(command -v Xvfb)"
 fi
 
 # --- Install Node.js and npm ---